@@ -1,10 +1,17 @@
 import streamlit as st
 import requests
+import numpy as np
 import sqlite3
 import hashlib
+import hmac
 from datetime import datetime
 import os
 
+try:
+    from numba import njit
+except ImportError:  # numba is an optional accelerator
+    njit = None
+
 
 
 # ================= CONFIG =================
@@ -15,10 +22,45 @@ DB_NAME = os.path.join(os.getcwd(), "meal.db")
 st.set_page_config(page_title="Universal Macro Calculator", page_icon="🥗")
 
 # ================= DATABASE =================
-def get_db():
-    return sqlite3.connect(DB_NAME, check_same_thread=False)
+# SQL hoisted to module scope: the same string object on every rerun,
+# so it always hits the connection's prepared-statement cache.
+SQL_SELECT_USER = "SELECT id, password, salt FROM users WHERE username=?"
+SQL_INSERT_USER = "INSERT INTO users (username, password, salt) VALUES (?, ?, ?)"
+SQL_INSERT_MEAL = "INSERT INTO meals (user_id, name, created_at) VALUES (?, ?, ?)"
+SQL_INSERT_ITEM = """
+    INSERT INTO meal_items
+    (meal_id, food_name, quantity, protein, carbs, fat, calories)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_LIST_MEALS = "SELECT id, name FROM meals WHERE user_id=? ORDER BY id DESC"
+SQL_LOAD_ITEMS = """
+    SELECT mi.food_name, mi.quantity, mi.protein, mi.carbs, mi.fat, mi.calories
+    FROM meal_items mi
+    JOIN meals m ON m.id = mi.meal_id
+    WHERE m.id=? AND m.user_id=?
+"""
 
-def hash_password(pw):
+@st.cache_resource
+def get_db():
+    # One shared connection per process; opening a fresh handle on every
+    # rerun thrashes the filesystem and defeats SQLite's statement cache.
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False, cached_statements=256)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=134217728")
+        conn.execute("PRAGMA cache_size=-20000")
+    except sqlite3.OperationalError:
+        pass  # read-only filesystem; run with SQLite defaults
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def hash_password(pw, salt):
+    return hashlib.scrypt(pw.encode(), salt=salt, n=16384, r=8, p=1).hex()
+
+def legacy_hash_password(pw):
+    # SHA-256 scheme used before per-user salts; kept so old rows still verify.
     return hashlib.sha256(pw.encode()).hexdigest()
 
 def init_db():
@@ -29,10 +71,16 @@ def init_db():
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             username TEXT UNIQUE,
-            password TEXT
+            password TEXT,
+            salt TEXT
         )
     """)
 
+    try:
+        cur.execute("ALTER TABLE users ADD COLUMN salt TEXT")
+    except sqlite3.OperationalError:
+        pass  # column already exists
+
     cur.execute("""
         CREATE TABLE IF NOT EXISTS meals (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -55,26 +103,85 @@ def init_db():
         )
     """)
 
+    # Covering index: serves the load-list query's WHERE, ORDER BY and
+    # projection from the index alone. meal_items index serves the Load
+    # Meal detail fetch.
+    cur.execute("DROP INDEX IF EXISTS idx_meals_user")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_meals_user_cover ON meals(user_id, id DESC, name)"
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_meal_items_meal ON meal_items(meal_id)")
+
     conn.commit()
-    conn.close()
 
-init_db()
+@st.cache_resource
+def _init_once():
+    # Schema setup is idempotent but still costs a write transaction;
+    # run it once per interpreter instead of on every script rerun.
+    init_db()
+    return True
+
+_init_once()
+
+@st.cache_data
+def list_meals(user_id, version):
+    # version is bumped on every save, so the cached list invalidates
+    # exactly when the table changes instead of on every rerun.
+    # Rows become plain tuples because st.cache_data pickles its values.
+    rows = get_db().execute(SQL_LIST_MEALS, (user_id,)).fetchall()
+    return [(r["id"], r["name"]) for r in rows]
+
+# ================= USDA API =================
+@st.cache_resource
+def http():
+    # Keep-alive session so consecutive searches reuse the TCP+TLS
+    # connection instead of paying a fresh handshake each time.
+    s = requests.Session()
+    s.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8))
+    return s
+
+@st.cache_data(ttl=3600, max_entries=256)
+def search_usda(query, page_size=5):
+    # Results for a given query are effectively immutable for a session,
+    # so repeat searches skip the 100-500 ms network round-trip.
+    r = http().get(
+        SEARCH_URL,
+        params={"query": query, "pageSize": page_size, "api_key": USDA_API_KEY},
+        timeout=10
+    )
+    r.raise_for_status()
+    return r.json().get("foods", [])
+
+# ================= MACRO MATH =================
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def meal_totals(arr):
+        # Compiled 4-column reduction; pays off on large loaded meals.
+        out = np.zeros(4)
+        for i in range(arr.shape[0]):
+            for j in range(4):
+                out[j] += arr[i, j]
+        return out
+else:
+    def meal_totals(arr):
+        return arr.sum(axis=0)
 
 # ================= SESSION STATE =================
-if "user" not in st.session_state:
-    st.session_state.user = None
-
-if "meal" not in st.session_state:
-    st.session_state.meal = []
-
-if "foods" not in st.session_state:
-    st.session_state.foods = []
-
-if "selected_food" not in st.session_state:
-    st.session_state.selected_food = None
-
-if "add_qty" not in st.session_state:
-    st.session_state.add_qty = 100.0
+# The current meal is a structure of arrays: a list of names plus an
+# (N, 5) float64 matrix with columns qty, protein, carbs, fat, calories.
+# No per-item dict allocations and the totals reduction stays vectorized.
+DEFAULTS = {
+    "user": None,
+    "meal_names": [],
+    "meal_arr": np.zeros((0, 5)),
+    "foods": [],
+    "selected_food": None,
+    "add_qty": 100.0,
+    "meals_version": 0,
+}
+
+for k, v in DEFAULTS.items():
+    st.session_state.setdefault(k, v)
 
 # ================= AUTH =================
 def auth_ui():
@@ -86,12 +193,20 @@ def auth_ui():
     if st.button("Login"):
         conn = get_db()
         cur = conn.cursor()
-        cur.execute("SELECT id, password FROM users WHERE username=?", (u,))
+        cur.execute(SQL_SELECT_USER, (u,))
         row = cur.fetchone()
-        conn.close()
 
-        if row and row[1] == hash_password(p):
-            st.session_state.user = {"id": row[0], "username": u}
+        if row and row["salt"]:
+            ok = hmac.compare_digest(
+                row["password"], hash_password(p, bytes.fromhex(row["salt"]))
+            )
+        elif row:
+            ok = hmac.compare_digest(row["password"], legacy_hash_password(p))
+        else:
+            ok = False
+
+        if ok:
+            st.session_state.user = {"id": row["id"], "username": u}
             st.rerun()
         else:
             st.error("Invalid credentials")
@@ -100,18 +215,15 @@ def auth_ui():
     st.subheader("Register")
 
     nu = st.text_input("New username")
-    np = st.text_input("New password", type="password")
+    npw = st.text_input("New password", type="password")
 
     if st.button("Create account"):
         try:
             conn = get_db()
             cur = conn.cursor()
-            cur.execute(
-                "INSERT INTO users (username, password) VALUES (?, ?)",
-                (nu, hash_password(np))
-            )
+            salt = os.urandom(16)
+            cur.execute(SQL_INSERT_USER, (nu, hash_password(npw, salt), salt.hex()))
             conn.commit()
-            conn.close()
             st.success("Account created. Please login.")
         except sqlite3.IntegrityError:
             st.error("Username already exists")
@@ -132,54 +244,72 @@ if st.button("Logout"):
 food_query = st.text_input("Search food", placeholder="apple, biryani, chicken curry")
 
 if st.button("🔍 Search") and food_query.strip():
-    r = requests.get(
-        SEARCH_URL,
-        params={"query": food_query, "pageSize": 5, "api_key": USDA_API_KEY},
-        timeout=10
-    )
-    st.session_state.foods = r.json().get("foods", [])
+    st.session_state.foods = search_usda(food_query.strip())
+    st.session_state.foods_by_desc = {
+        f["description"]: f for f in st.session_state.foods
+    }
+    st.session_state.food_descriptions = list(st.session_state.foods_by_desc)
     st.session_state.selected_food = None
 
 # ================= FOOD SELECTION =================
 if st.session_state.foods:
-    name = st.selectbox(
-        "Select food",
-        [f["description"] for f in st.session_state.foods]
-    )
-    st.session_state.selected_food = next(
-        f for f in st.session_state.foods if f["description"] == name
-    )
+    name = st.selectbox("Select food", st.session_state.food_descriptions)
+    food = st.session_state.foods_by_desc[name]
+
+    # Parse the nutrient payload only when the selection changes, not on
+    # every rerun triggered by the quantity widgets below.
+    if food is not st.session_state.selected_food:
+        st.session_state.selected_food = food
+        nutrients = {
+            n["nutrientName"]: float(n["value"])
+            for n in food.get("foodNutrients", [])
+        }
+        base_p = nutrients.get("Protein", 0.0)
+        base_c = nutrients.get("Carbohydrate, by difference", 0.0)
+        base_f = nutrients.get("Total lipid (fat)", 0.0)
+        st.session_state.base_macros = (
+            base_p,
+            base_c,
+            base_f,
+            nutrients.get("Energy", base_p*4 + base_c*4 + base_f*9)
+        )
 
 # ================= LIVE MACRO PREVIEW =================
+# Button callbacks run before the rerun, so the quantity widget (bound
+# via key="add_qty") picks the new value up in the same cycle instead of
+# forcing an extra rerun through a double-write.
+def _bump_qty(delta):
+    st.session_state.add_qty = max(1.0, st.session_state.add_qty + delta)
+
+def _add_to_meal():
+    base_p, base_c, base_f, base_cal = st.session_state.base_macros
+    qty = float(st.session_state.add_qty)
+    st.session_state.meal_names.append(st.session_state.selected_food["description"])
+    st.session_state.meal_arr = np.vstack([
+        st.session_state.meal_arr,
+        [qty, base_p * qty / 100, base_c * qty / 100,
+         base_f * qty / 100, base_cal * qty / 100]
+    ])
+    st.session_state.add_qty = 100.0
+
 if st.session_state.selected_food:
     food = st.session_state.selected_food
-
-    nutrients = {
-        n["nutrientName"]: float(n["value"])
-        for n in food.get("foodNutrients", [])
-    }
-
-    base_p = nutrients.get("Protein", 0.0)
-    base_c = nutrients.get("Carbohydrate, by difference", 0.0)
-    base_f = nutrients.get("Total lipid (fat)", 0.0)
-    base_cal = nutrients.get("Energy", base_p*4 + base_c*4 + base_f*9)
+    base_p, base_c, base_f, base_cal = st.session_state.base_macros
 
     st.subheader("Quantity (grams)")
     c1, c2, c3 = st.columns([1, 2, 1])
 
-    if c1.button("➖"):
-        st.session_state.add_qty = max(1.0, st.session_state.add_qty - 10.0)
+    c1.button("➖", on_click=_bump_qty, args=(-10.0,))
 
-    st.session_state.add_qty = c2.number_input(
+    c2.number_input(
         " ",
         min_value=1.0,
-        value=float(st.session_state.add_qty),
         step=10.0,
+        key="add_qty",
         label_visibility="collapsed"
     )
 
-    if c3.button("➕"):
-        st.session_state.add_qty += 10.0
+    c3.button("➕", on_click=_bump_qty, args=(10.0,))
 
     qty = float(st.session_state.add_qty)
 
@@ -198,64 +328,49 @@ if st.session_state.selected_food:
 """
     )
 
-    if st.button("➕ Add to Meal"):
-        st.session_state.meal.append({
-            "name": food["description"],
-            "quantity": qty,
-            "protein": protein,
-            "carbs": carbs,
-            "fat": fat,
-            "calories": calories
-        })
-        st.session_state.add_qty = 100.0
-        st.rerun()
+    st.button("➕ Add to Meal", on_click=_add_to_meal)
 
 # ================= CURRENT MEAL =================
 st.divider()
 st.subheader("🍽️ Current Meal")
 
-total_p = total_c = total_f = total_cal = 0.0
-
-for i, item in enumerate(st.session_state.meal):
+for i, item_name in enumerate(st.session_state.meal_names):
+    row = st.session_state.meal_arr[i]
     c1, c2, c3 = st.columns([5, 3, 1])
 
     with c1:
-        st.write(f"**{item['name']}**")
+        st.write(f"**{item_name}**")
         st.caption(
-            f"{item['quantity']:.0f} g | "
-            f"P {item['protein']:.1f}g | "
-            f"C {item['carbs']:.1f}g | "
-            f"F {item['fat']:.1f}g | "
-            f"Cal {item['calories']:.1f}g"
+            f"{row[0]:.0f} g | "
+            f"P {row[1]:.1f}g | "
+            f"C {row[2]:.1f}g | "
+            f"F {row[3]:.1f}g | "
+            f"Cal {row[4]:.1f}g"
         )
 
     with c2:
         new_qty = st.number_input(
             "Qty",
             min_value=1.0,
-            value=float(item["quantity"]),
+            value=float(row[0]),
             step=10.0,
             key=f"edit_{i}"
         )
 
-        if new_qty != item["quantity"]:
-            factor = new_qty / item["quantity"]
-            item["quantity"] = new_qty
-            item["protein"] *= factor
-            item["carbs"] *= factor
-            item["fat"] *= factor
-            item["calories"] *= factor
+        if new_qty != row[0]:
+            # Scaling the whole row by the qty ratio rescales every macro
+            # (and sets the qty column to new_qty) in one vector op.
+            st.session_state.meal_arr[i] *= new_qty / row[0]
             st.rerun()
 
     with c3:
         if st.button("❌", key=f"del_{i}"):
-            st.session_state.meal.pop(i)
+            st.session_state.meal_names.pop(i)
+            st.session_state.meal_arr = np.delete(st.session_state.meal_arr, i, axis=0)
             st.rerun()
 
-    total_p += item["protein"]
-    total_c += item["carbs"]
-    total_f += item["fat"]
-    total_cal += item["calories"]
+# Single vectorized reduction instead of four Python adds per item.
+total_p, total_c, total_f, total_cal = meal_totals(st.session_state.meal_arr[:, 1:])
 
 c1, c2, c3, c4 = st.columns(4)
 c1.metric("Protein (g)", f"{total_p:.1f}")
@@ -267,76 +382,62 @@ c4.metric("Calories", f"{total_cal:.0f} kcal")
 st.divider()
 st.subheader("💾 Save / Load Meals")
 
-meal_name = st.text_input(
-    "Meal name",
-    value=f"Meal {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-)
+# Compute the default once per session: a per-rerun datetime.now() both
+# wastes a strftime and silently resets user-typed input as time passes.
+st.session_state.setdefault("default_meal_name", f"Meal {datetime.now():%Y-%m-%d %H:%M}")
+
+meal_name = st.text_input("Meal name", value=st.session_state.default_meal_name)
 
 c1, c2, c3 = st.columns(3)
 
 with c1:
-    if st.button("💾 Save Meal") and st.session_state.meal:
+    if st.button("💾 Save Meal") and st.session_state.meal_names:
         conn = get_db()
-        cur = conn.cursor()
 
-        cur.execute(
-            "INSERT INTO meals (user_id, name, created_at) VALUES (?, ?, ?)",
-            (st.session_state.user["id"], meal_name, datetime.now().isoformat())
-        )
-        meal_id = cur.lastrowid
-
-        for item in st.session_state.meal:
-            cur.execute("""
-                INSERT INTO meal_items
-                (meal_id, food_name, quantity, protein, carbs, fat, calories)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (
-                meal_id,
-                item["name"],
-                item["quantity"],
-                item["protein"],
-                item["carbs"],
-                item["fat"],
-                item["calories"]
-            ))
-
-        conn.commit()
-        conn.close()
-        st.success("Meal saved")
+        with conn:
+            cur = conn.cursor()
+            cur.execute(
+                SQL_INSERT_MEAL,
+                (st.session_state.user["id"], meal_name, datetime.now().isoformat())
+            )
+            meal_id = cur.lastrowid
 
-with c2:
-    conn = get_db()
-    meals = conn.execute(
-        "SELECT id, name FROM meals WHERE user_id=? ORDER BY id DESC",
-        (st.session_state.user["id"],)
-    ).fetchall()
-    conn.close()
+            cur.executemany(SQL_INSERT_ITEM, [
+                (meal_id, item_name, *map(float, row))
+                for item_name, row in zip(
+                    st.session_state.meal_names, st.session_state.meal_arr
+                )
+            ])
 
-    if meals:
-        sel = st.selectbox("Load saved meal", meals, format_func=lambda x: x[1])
+        st.session_state.meals_version += 1
+        st.success("Meal saved")
 
-        if st.button("📂 Load Meal"):
-            conn = get_db()
-            rows = conn.execute("""
-                SELECT food_name, quantity, protein, carbs, fat, calories
-                FROM meal_items WHERE meal_id=?
-            """, (sel[0],)).fetchall()
-            conn.close()
-
-            st.session_state.meal = [
-                {
-                    "name": r[0],
-                    "quantity": r[1],
-                    "protein": r[2],
-                    "carbs": r[3],
-                    "fat": r[4],
-                    "calories": r[5]
-                }
-                for r in rows
-            ]
-            st.rerun()
+with c2:
+    # Hide the load pane behind a toggle so sessions that never load a
+    # meal skip the list query entirely; the covering index on
+    # meals(user_id, id DESC, name) answers it without touching the table.
+    if st.toggle("Load saved meal"):
+        meals = list_meals(st.session_state.user["id"], st.session_state.meals_version)
+
+        if meals:
+            sel = st.selectbox("Saved meals", meals, format_func=lambda x: x[1])
+
+            if st.button("📂 Load Meal"):
+                conn = get_db()
+                rows = conn.execute(
+                    SQL_LOAD_ITEMS, (sel[0], st.session_state.user["id"])
+                ).fetchall()
+
+                st.session_state.meal_names = [r["food_name"] for r in rows]
+                st.session_state.meal_arr = np.array(
+                    [tuple(r)[1:] for r in rows], dtype=np.float64
+                ).reshape(-1, 5)
+                st.rerun()
+        else:
+            st.caption("No saved meals yet")
 
 with c3:
     if st.button("🧹 Clear Meal"):
-        st.session_state.meal = []
+        st.session_state.meal_names = []
+        st.session_state.meal_arr = np.zeros((0, 5))
         st.rerun()